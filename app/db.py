@@ -1,11 +1,45 @@
-from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from pathlib import Path
 
 DB_PATH = Path("weather.db")
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
+engine = create_async_engine(
+    f"sqlite+aiosqlite:///{DB_PATH}",
+    echo=False,
+    pool_pre_ping=True,
+)
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+# WAL lets readers run during a write; NORMAL skips the fsync on every commit.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+)
 
-def get_session():
-    return Session(engine)
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cur.execute(pragma)
+    cur.close()
+
+def _create_all(conn):
+    SQLModel.metadata.create_all(conn)
+    # create_all skips tables that already exist, so add any new indexes to older DBs.
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+async def create_db_and_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(_create_all)
+
+async def get_session():
+    # FastAPI dependency: one AsyncSession per request, closed once the handler is done.
+    # expire_on_commit=False: expired attributes can't lazy-load outside the async context.
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        yield session
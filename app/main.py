@@ -1,32 +1,104 @@
 from __future__ import annotations
+import asyncio
 import logging
 import urllib.parse as up
 import csv
 import io
-from fastapi import FastAPI, Request, Form, status, Query, Body
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, Response
+import orjson
+import os
+import re
+from fastapi import FastAPI, Request, Form, status, Query, Body, Depends
+from fastapi.responses import HTMLResponse, RedirectResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from typing import Optional
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from datetime import date
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.services.geo import geocode_one
-from app.services.weather import get_current_weather, get_forecast_5d, get_daily_range
-from app.services.validators import validate_date_range
-from app.db import create_db_and_tables, get_session
-from app.repositories.queries import create_query_with_snapshot, list_queries, get_query, get_latest_snapshot, unpack_snapshot, update_query_core, append_snapshot, delete_query_cascade
+from app.services.geo import geocode_one, init_client as init_geo_client, close_client as close_geo_client
+from app.services.weather import get_current_weather, get_forecast_5d, get_daily_range, init_client as init_weather_client, close_client as close_weather_client
+from app.services.validators import DateRange, validate_date_range
+from app.db import create_db_and_tables, get_session, engine
+from app.repositories.queries import create_query_with_snapshot, list_queries, iter_export_rows, get_export_row, get_query, get_query_with_latest_snapshot, unpack_snapshot, update_query_and_append_snapshot, delete_query_cascade
 
-app = FastAPI(title="Weather App")
+app = FastAPI(title="Weather App", default_response_class=ORJSONResponse)
 
 logging.basicConfig(level=logging.INFO)
 
-templates = Jinja2Templates(directory="app/templates")
+# Set WEATHER_APP_DEBUG=1 to pick up template edits without a restart.
+DEBUG = os.getenv("WEATHER_APP_DEBUG") == "1"
 
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# The on-disk bytecode cache is attached at startup (see on_startup).
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader("app/templates"),
+    autoescape=True,
+    auto_reload=DEBUG,
+    cache_size=400,
+))
+
+# e.g. app.3f2a9c1d.js — the content hash changes whenever the file does.
+HASHED_ASSET_RE = re.compile(r"\.[0-9a-f]{8,}\.\w+$")
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with Cache-Control: content-hashed assets are cached for a
+    year as immutable, everything else for an hour.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if HASHED_ASSET_RE.search(scope["path"]):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, max-age=3600"
+        return response
+
+
+app.mount("/static", CachedStaticFiles(directory="app/static"), name="static")
 
 @app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def on_startup():
+    # Compiled templates are cached on disk so new workers skip the parse step.
+    # No directory argument: Jinja then uses a per-user 0700 directory and
+    # checks its owner, so other local users can't plant bytecode in it.
+    templates.env.bytecode_cache = FileSystemBytecodeCache()
+    await create_db_and_tables()
+    init_geo_client()
+    init_weather_client()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await close_geo_client()
+    await close_weather_client()
+
+
+async def _fetch_weather(lat: float, lon: float, dr):
+    """
+    Fetch current weather and daily rows (date range or 5-day) concurrently.
+    Upstream exceptions are mapped to None, same as a failed lookup.
+    """
+    current, daily = await asyncio.gather(
+        get_current_weather(lat, lon),
+        get_daily_range(lat, lon, dr.start, dr.end) if dr else get_forecast_5d(lat, lon),
+        return_exceptions=True,
+    )
+    if isinstance(current, Exception):
+        logging.warning("Current weather fetch failed: %s", current)
+        current = None
+    if isinstance(daily, Exception):
+        logging.warning("Daily weather fetch failed: %s", daily)
+        daily = None
+    return current, daily
+
+
+def _as_stored(data):
+    # result.html always receives the stored-snapshot shape: plain dicts, as
+    # unpack_snapshot returns them. Fresh CurrentWeather/DailyRow results go
+    # through the same orjson encoding the snapshot columns use.
+    return orjson.loads(orjson.dumps(data))
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -43,6 +115,8 @@ async def search(
     q: str = Form(...),
     start: Optional[str] = Form(None),
     end: Optional[str] = Form(None),
+    redirect: bool = Query(False),
+    session: AsyncSession = Depends(get_session),
 ):
     # 1) Validate optional date range
     try:
@@ -61,38 +135,46 @@ async def search(
 
     lat = float(resolved["lat"]); lon = float(resolved["lon"])
 
-    # 3) Fetch data (range vs 5-day)
-    if dr:
-        range_rows = await get_daily_range(lat, lon, dr.start, dr.end)
-        if range_rows is None:
-            return templates.TemplateResponse("index.html", {"request": request, "error": "Could not fetch date-range data."}, status_code=502)
-        current = await get_current_weather(lat, lon)
-        if current is None:
-            return templates.TemplateResponse("index.html", {"request": request, "error": "Weather lookup failed. Please try again."}, status_code=502)
-        forecast_for_storage = range_rows
-    else:
-        current = await get_current_weather(lat, lon)
-        if current is None:
-            return templates.TemplateResponse("index.html", {"request": request, "error": "Weather lookup failed. Please try again."}, status_code=502)
-        forecast_for_storage = await get_forecast_5d(lat, lon) or []
+    # 3) Fetch data (range vs 5-day), current + daily in parallel
+    current, daily = await _fetch_weather(lat, lon, dr)
+    if dr and daily is None:
+        return templates.TemplateResponse("index.html", {"request": request, "error": "Could not fetch date-range data."}, status_code=502)
+    if current is None:
+        return templates.TemplateResponse("index.html", {"request": request, "error": "Weather lookup failed. Please try again."}, status_code=502)
+    forecast_for_storage = daily or []
 
     # 4) Persist
-    with get_session() as session:
-        row = create_query_with_snapshot(
-            session,
-            input_text=q or "direct-latlon/geolocation",
-            resolved_name=resolved["name"],
-            lat=lat,
-            lon=lon,
-            current=current,
-            forecast=forecast_for_storage,
-            date_range=(dr.start, dr.end) if dr else None,
-        )
-        query_id = row.id
-
-    # 5) Redirect to read by id
-    url = "/result?" + up.urlencode({"id": str(query_id)})
-    return RedirectResponse(url, status_code=status.HTTP_303_SEE_OTHER)
+    row = await create_query_with_snapshot(
+        session,
+        input_text=q or "direct-latlon/geolocation",
+        resolved_name=resolved["name"],
+        lat=lat,
+        lon=lon,
+        current=current,
+        forecast=forecast_for_storage,
+        date_range=(dr.start, dr.end) if dr else None,
+    )
+    query_id = row.id
+
+    # 5) Render the result from memory (saves a round-trip + DB read);
+    #    /search?redirect=1 keeps the classic PRG redirect to /result?id=…
+    if redirect:
+        url = "/result?" + up.urlencode({"id": str(query_id)})
+        return RedirectResponse(url, status_code=status.HTTP_303_SEE_OTHER)
+
+    rows = _as_stored(forecast_for_storage)
+    range_rows = rows if dr else None
+    ctx = {
+        "request": request,
+        "id": query_id,
+        "query": row.input_text,
+        "resolved": {"name": resolved["name"], "lat": lat, "lon": lon},
+        "current": _as_stored(current),
+        "forecast": None if range_rows else rows,
+        "range_rows": range_rows,
+        "date_range": dr,
+    }
+    return templates.TemplateResponse("result.html", ctx)
 
 
 
@@ -107,32 +189,31 @@ async def result(
     lon: Optional[float] = Query(None),
     start: Optional[str] = Query(None),
     end: Optional[str] = Query(None),
+    session: AsyncSession = Depends(get_session),
 ):
     """
     Preferred path: id=<query_id> — loads stored snapshot (READ).
     Back-compat: if no id, falls back to live fetch (not persisted).
     """
     if id is not None:
-        with get_session() as session:
-            row = get_query(session, id)
-            if not row:
-                return templates.TemplateResponse("index.html", {"request": request, "error": "Record not found."}, status_code=404)
-            snap = get_latest_snapshot(session, id)
-            current, forecast = unpack_snapshot(snap)
-
-            # If this row has a date range, we show it as "range_rows"
-            range_rows = forecast if (row.date_start or row.date_end) else None
-            ctx = {
-                "request": request,
-                "id": row.id,
-                "query": row.input_text,
-                "resolved": {"name": row.resolved_name, "lat": row.lat, "lon": row.lon},
-                "current": current,
-                "forecast": None if range_rows else forecast,
-                "range_rows": range_rows,
-                "date_range": None if not (row.date_start and row.date_end) else type("DR", (), {"start": row.date_start, "end": row.date_end})(),
-            }
-            return templates.TemplateResponse("result.html", ctx)
+        row, snap = await get_query_with_latest_snapshot(session, id)
+        if not row:
+            return templates.TemplateResponse("index.html", {"request": request, "error": "Record not found."}, status_code=404)
+        current, forecast = unpack_snapshot(snap)
+
+        # If this row has a date range, we show it as "range_rows"
+        range_rows = forecast if (row.date_start or row.date_end) else None
+        ctx = {
+            "request": request,
+            "id": row.id,
+            "query": row.input_text,
+            "resolved": {"name": row.resolved_name, "lat": row.lat, "lon": row.lon},
+            "current": current,
+            "forecast": None if range_rows else forecast,
+            "range_rows": range_rows,
+            "date_range": None if not (row.date_start and row.date_end) else DateRange(start=row.date_start, end=row.date_end),
+        }
+        return templates.TemplateResponse("result.html", ctx)
 
     # Back-compat path: compute live (but do not persist)
     if lat is None or lon is None or name is None:
@@ -153,9 +234,9 @@ async def result(
             "request": request,
             "query": q,
             "resolved": {"name": name, "lat": lat, "lon": lon},
-            "current": current,
+            "current": _as_stored(current),
             "forecast": None,
-            "range_rows": range_rows,
+            "range_rows": _as_stored(range_rows),
             "date_range": dr,
         }
     else:
@@ -165,8 +246,8 @@ async def result(
             "request": request,
             "query": q,
             "resolved": {"name": name, "lat": lat, "lon": lon},
-            "current": current,
-            "forecast": forecast,
+            "current": _as_stored(current),
+            "forecast": _as_stored(forecast),
             "range_rows": None,
             "date_range": None,
         }
@@ -175,18 +256,16 @@ async def result(
 
 
 @app.get("/history", response_class=HTMLResponse)
-def history(request: Request):
-    with get_session() as session:
-        rows = list_queries(session, limit=50)
+async def history(request: Request, session: AsyncSession = Depends(get_session)):
+    rows = await list_queries(session, limit=50)
     return templates.TemplateResponse("history.html", {"request": request, "rows": rows})
 
 
 @app.get("/edit", response_class=HTMLResponse)
-def edit(request: Request, id: int = Query(...)):
-    with get_session() as session:
-        row = get_query(session, id)
-        if not row:
-            return templates.TemplateResponse("index.html", {"request": request, "error": "Record not found."}, status_code=404)
+async def edit(request: Request, id: int = Query(...), session: AsyncSession = Depends(get_session)):
+    row = await get_query(session, id)
+    if not row:
+        return templates.TemplateResponse("index.html", {"request": request, "error": "Record not found."}, status_code=404)
     return templates.TemplateResponse("edit.html", {"request": request, "row": row})
 
 
@@ -198,146 +277,151 @@ async def update(
     label: Optional[str] = Form(None),
     start: Optional[str] = Form(None),
     end: Optional[str] = Form(None),
+    session: AsyncSession = Depends(get_session),
 ):
     # Validate date range
     try:
         dr = validate_date_range(start, end)
     except ValueError as e:
-        with get_session() as session:
-            row = get_query(session, id)
-        return templates.TemplateResponse("edit.html", {"request": request, "row": row, "error": str(e)}, status_code=400)
+        return templates.TemplateResponse("edit.html", {"request": request, "row": await get_query(session, id), "error": str(e)}, status_code=400)
 
     # Resolve location (allows edit)
     resolved = await geocode_one(input_text)
     if resolved is None:
-        with get_session() as session:
-            row = get_query(session, id)
-        return templates.TemplateResponse("edit.html", {"request": request, "row": row, "error": "Could not resolve that location."}, status_code=400)
+        return templates.TemplateResponse("edit.html", {"request": request, "row": await get_query(session, id), "error": "Could not resolve that location."}, status_code=400)
 
     lat = float(resolved["lat"]); lon = float(resolved["lon"])
 
-    # Fetch current + daily (range or 5-day)
-    if dr:
-        range_rows = await get_daily_range(lat, lon, dr.start, dr.end)
-        if range_rows is None:
-            with get_session() as session:
-                row = get_query(session, id)
-            return templates.TemplateResponse("edit.html", {"request": request, "row": row, "error": "Could not fetch date-range data."}, status_code=502)
-        current = await get_current_weather(lat, lon)
-        forecast_for_storage = range_rows
-    else:
-        current = await get_current_weather(lat, lon)
-        if current is None:
-            with get_session() as session:
-                row = get_query(session, id)
-            return templates.TemplateResponse("edit.html", {"request": request, "row": row, "error": "Weather lookup failed."}, status_code=502)
-        forecast_for_storage = await get_forecast_5d(lat, lon) or []
+    # Fetch current + daily (range or 5-day) in parallel
+    current, daily = await _fetch_weather(lat, lon, dr)
+    if dr and daily is None:
+        return templates.TemplateResponse("edit.html", {"request": request, "row": await get_query(session, id), "error": "Could not fetch date-range data."}, status_code=502)
+    if not dr and current is None:
+        return templates.TemplateResponse("edit.html", {"request": request, "row": await get_query(session, id), "error": "Weather lookup failed."}, status_code=502)
+    forecast_for_storage = daily or []
 
     # Update row + append snapshot
-    with get_session() as session:
-        updated = update_query_core(
-            session,
-            query_id=id,
-            input_text=input_text,
-            resolved_name=resolved["name"],
-            lat=lat,
-            lon=lon,
-            date_range=(dr.start, dr.end) if dr else (None, None),
-            label=label,
-        )
-        if not updated:
-            return templates.TemplateResponse("index.html", {"request": request, "error": "Record not found."}, status_code=404)
-        append_snapshot(session, query_id=id, current=current, forecast=forecast_for_storage)
+    updated = await update_query_and_append_snapshot(
+        session,
+        query_id=id,
+        current=current,
+        forecast=forecast_for_storage,
+        input_text=input_text,
+        resolved_name=resolved["name"],
+        lat=lat,
+        lon=lon,
+        date_range=(dr.start, dr.end) if dr else (None, None),
+        label=label,
+    )
+    if not updated:
+        return templates.TemplateResponse("index.html", {"request": request, "error": "Record not found."}, status_code=404)
 
     # Redirect to view
     return RedirectResponse(f"/result?id={id}", status_code=303)
 
 
 @app.post("/delete", response_class=HTMLResponse)
-def delete(request: Request, id: int = Form(...)):
-    with get_session() as session:
-        ok = delete_query_cascade(session, id)
+async def delete(request: Request, id: int = Form(...), session: AsyncSession = Depends(get_session)):
+    ok = await delete_query_cascade(session, id)
     if not ok:
         return templates.TemplateResponse("index.html", {"request": request, "error": "Record not found."}, status_code=404)
     return RedirectResponse("/history", status_code=303)
 
 
+# Same order as the tuples from iter_export_rows.
+EXPORT_COLUMNS = ["id","input_text","resolved_name","lat","lon","date_start","date_end","label","created_at"]
+
+
+def _export_dict(r) -> dict:
+    # date/datetime values are left as-is; orjson emits them as ISO 8601.
+    return {
+        "id": r.id,
+        "input_text": r.input_text,
+        "resolved_name": r.resolved_name,
+        "lat": r.lat, "lon": r.lon,
+        "date_start": r.date_start,
+        "date_end": r.date_end,
+        "label": r.label,
+        "created_at": r.created_at,
+    }
+
+
+def _export_csv_row(row) -> tuple:
+    # Takes an EXPORT_COLUMNS tuple. csv writes None as "" and dates as ISO;
+    # only created_at needs isoformat() for the "T" form.
+    id_, input_text, resolved_name, lat, lon, date_start, date_end, label, created_at = row
+    return (id_, input_text, resolved_name, lat, lon, date_start, date_end, label, created_at.isoformat())
+
+
+async def _stream_json_export():
+    # Hand-framed JSON array so rows are never all held in memory.
+    # Streams outlive the request's injected session, so they open their own.
+    yield b"["
+    async with AsyncSession(engine) as session:
+        sep = b""
+        async for row in iter_export_rows(session, limit=1000):
+            yield sep + orjson.dumps(dict(zip(EXPORT_COLUMNS, row)))
+            sep = b","
+    yield b"]"
+
+
+async def _stream_csv_export():
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def flush() -> str:
+        out = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return out
+
+    writer.writerow(EXPORT_COLUMNS)
+    yield flush()
+    async with AsyncSession(engine) as session:
+        async for row in iter_export_rows(session, limit=1000):
+            writer.writerow(_export_csv_row(row))
+            yield flush()
+
+
 @app.get("/export/json")
-def export_json(id: Optional[int] = Query(None)):
-    with get_session() as session:
-        if id is not None:
-            row = get_query(session, id)
-            if not row:
-                return JSONResponse({"error": "Record not found."}, status_code=404)
-            snap = get_latest_snapshot(session, id)
-            current, forecast = unpack_snapshot(snap)
-            payload = {
-                "query": {
-                    "id": row.id,
-                    "input_text": row.input_text,
-                    "resolved_name": row.resolved_name,
-                    "lat": row.lat, "lon": row.lon,
-                    "date_start": row.date_start.isoformat() if row.date_start else None,
-                    "date_end": row.date_end.isoformat() if row.date_end else None,
-                    "label": row.label,
-                    "created_at": row.created_at.isoformat(),
-                },
-                "snapshot": {"current": current, "forecast": forecast},
-            }
-            filename = f"weather_{id}.json" if id is not None else "weather_queries.json"
-            return JSONResponse(
-                payload,
-                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-            )   
-        else:
-            rows = list_queries(session, limit=1000)
-            payload = []
-            for r in rows:
-                payload.append({
-                    "id": r.id,
-                    "input_text": r.input_text,
-                    "resolved_name": r.resolved_name,
-                    "lat": r.lat, "lon": r.lon,
-                    "date_start": r.date_start.isoformat() if r.date_start else None,
-                    "date_end": r.date_end.isoformat() if r.date_end else None,
-                    "label": r.label,
-                    "created_at": r.created_at.isoformat(),
-                })
-            return JSONResponse(payload)
+async def export_json(id: Optional[int] = Query(None)):
+    # No injected session: the streams open their own, and only the id lookup needs one.
+    if id is None:
+        return StreamingResponse(_stream_json_export(), media_type="application/json")
+
+    async with AsyncSession(engine) as session:
+        row, snap = await get_query_with_latest_snapshot(session, id)
+    if not row:
+        return ORJSONResponse({"error": "Record not found."}, status_code=404)
+    current, forecast = unpack_snapshot(snap)
+    payload = {
+        "query": _export_dict(row),
+        "snapshot": {"current": current, "forecast": forecast},
+    }
+    return ORJSONResponse(
+        payload,
+        headers={"Content-Disposition": f'attachment; filename="weather_{id}.json"'}
+    )
 
 @app.get("/export/csv")
-def export_csv(id: Optional[int] = Query(None)):
+async def export_csv(id: Optional[int] = Query(None)):
+    if id is None:
+        return StreamingResponse(
+            _stream_csv_export(),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="weather_queries.csv"'}
+        )
+
+    async with AsyncSession(engine) as session:
+        row = await get_export_row(session, id)
+    if not row:
+        return PlainTextResponse("Record not found.", status_code=404)
     buf = io.StringIO()
     writer = csv.writer(buf)
-    if id is not None:
-        # single row: flatten a bit
-        with get_session() as session:
-            row = get_query(session, id)
-            if not row:
-                return PlainTextResponse("Record not found.", status_code=404)
-            writer.writerow(["id","input_text","resolved_name","lat","lon","date_start","date_end","label","created_at"])
-            writer.writerow([
-                row.id, row.input_text, row.resolved_name, row.lat, row.lon,
-                row.date_start.isoformat() if row.date_start else "",
-                row.date_end.isoformat() if row.date_end else "",
-                row.label or "",
-                row.created_at.isoformat(),
-            ])
-    else:
-        with get_session() as session:
-            rows = list_queries(session, limit=1000)
-        writer.writerow(["id","input_text","resolved_name","lat","lon","date_start","date_end","label","created_at"])
-        for r in rows:
-            writer.writerow([
-                r.id, r.input_text, r.resolved_name, r.lat, r.lon,
-                r.date_start.isoformat() if r.date_start else "",
-                r.date_end.isoformat() if r.date_end else "",
-                r.label or "",
-                r.created_at.isoformat(),
-            ])
-    filename = f"weather_{id}.csv" if id is not None else "weather_queries.csv"
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerow(_export_csv_row(row))
     return Response(
         buf.getvalue(),
         media_type="text/csv; charset=utf-8",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
\ No newline at end of file
+        headers={"Content-Disposition": f'attachment; filename="weather_{id}.csv"'}
+    )
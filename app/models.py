@@ -1,8 +1,11 @@
 from datetime import datetime, date
 from typing import Optional
+from sqlalchemy import Column, Index, LargeBinary
 from sqlmodel import SQLModel, Field, Relationship
 
 class SearchQuery(SQLModel, table=True):
+    __table_args__ = (Index("ix_query_created", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     input_text: str
     resolved_name: str
@@ -19,10 +22,13 @@ class SearchQuery(SQLModel, table=True):
     )
 
 class WeatherSnapshot(SQLModel, table=True):
+    __table_args__ = (Index("ix_snap_query_created", "query_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     query_id: int = Field(foreign_key="searchquery.id")
-    current_json: str
-    forecast_json: str
+    # orjson-encoded payloads stored as BLOBs
+    current_json: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    forecast_json: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     query: Optional[SearchQuery] = Relationship(back_populates="snapshots")
\ No newline at end of file
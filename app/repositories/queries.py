@@ -1,18 +1,21 @@
-import json
-from typing import Optional, Tuple, List
+import orjson
+from typing import TYPE_CHECKING, Optional, Tuple, List, AsyncIterator
 from sqlmodel import select
 from app.models import SearchQuery, WeatherSnapshot
 from datetime import date
 
-def create_query_with_snapshot(
+if TYPE_CHECKING:  # hints only; keeps the DB layer free of the HTTP service module
+    from app.services.weather import CurrentWeather, DailyRow
+
+async def create_query_with_snapshot(
     session,
     *,
     input_text: str,
     resolved_name: str,
     lat: float,
     lon: float,
-    current: dict,
-    forecast: Optional[list] = None,
+    current: Optional["CurrentWeather"],
+    forecast: Optional[List["DailyRow"]] = None,
     date_range: Optional[Tuple[Optional[date], Optional[date]]] = None, 
     label: Optional[str] = None,
 ) -> SearchQuery:
@@ -26,43 +29,77 @@ def create_query_with_snapshot(
         label=label,
     )
     session.add(q)
-    session.flush()  # ensures q.id exists
+    await session.flush()  # ensures q.id exists
 
     snap = WeatherSnapshot(
         query_id=q.id,
-        current_json=json.dumps(current),
-        forecast_json=json.dumps(forecast or []),
+        current_json=orjson.dumps(current),
+        forecast_json=orjson.dumps(forecast or []),
     )
     session.add(snap)
-    session.commit()
-    session.refresh(q)
+    await session.commit()
+    await session.refresh(q)
     return q
 
-def list_queries(session, limit: int = 50):
+async def list_queries(session, limit: int = 50):
     stmt = select(SearchQuery).order_by(SearchQuery.created_at.desc()).limit(limit)
-    return session.exec(stmt).all()
+    return (await session.exec(stmt)).all()
+
+def _select_export_columns():
+    # Plain column tuples (no ORM hydration), in this order:
+    # id, input_text, resolved_name, lat, lon, date_start, date_end, label, created_at
+    return select(
+        SearchQuery.id, SearchQuery.input_text, SearchQuery.resolved_name,
+        SearchQuery.lat, SearchQuery.lon,
+        SearchQuery.date_start, SearchQuery.date_end,
+        SearchQuery.label, SearchQuery.created_at,
+    )
+
+async def iter_export_rows(session, limit: int = 1000, batch_size: int = 200) -> AsyncIterator[tuple]:
+    # Stream export column tuples newest-first, `batch_size` at a time.
+    stmt = (
+        _select_export_columns()
+        .order_by(SearchQuery.created_at.desc())
+        .limit(limit)
+        .execution_options(yield_per=batch_size)
+    )
+    async for row in await session.stream(stmt):
+        yield row
 
-def get_query(session, qid: int) -> Optional[SearchQuery]:
-    return session.get(SearchQuery, qid)
+async def get_export_row(session, qid: int) -> Optional[tuple]:
+    # One export column tuple, same order as iter_export_rows.
+    stmt = _select_export_columns().where(SearchQuery.id == qid)
+    return (await session.exec(stmt)).first()
 
-def get_latest_snapshot(session, query_id: int) -> Optional[WeatherSnapshot]:
+async def get_query(session, qid: int) -> Optional[SearchQuery]:
+    return await session.get(SearchQuery, qid)
+
+async def get_query_with_latest_snapshot(
+    session, qid: int
+) -> Tuple[Optional[SearchQuery], Optional[WeatherSnapshot]]:
+    # One round-trip: the query row LEFT JOINed to its newest snapshot.
     stmt = (
-        select(WeatherSnapshot)
-        .where(WeatherSnapshot.query_id == query_id)
+        select(SearchQuery, WeatherSnapshot)
+        .join(WeatherSnapshot, WeatherSnapshot.query_id == SearchQuery.id, isouter=True)
+        .where(SearchQuery.id == qid)
         .order_by(WeatherSnapshot.created_at.desc())
         .limit(1)
     )
-    return session.exec(stmt).first()
+    found = (await session.exec(stmt)).first()
+    return (found[0], found[1]) if found else (None, None)
 
 def unpack_snapshot(snapshot: WeatherSnapshot) -> Tuple[dict, List[dict]]:
-    current = json.loads(snapshot.current_json) if snapshot and snapshot.current_json else {}
-    forecast = json.loads(snapshot.forecast_json) if snapshot and snapshot.forecast_json else []
+    # orjson.loads takes bytes (BLOB rows) and str (rows written before the BLOB switch).
+    current = orjson.loads(snapshot.current_json) if snapshot and snapshot.current_json else {}
+    forecast = orjson.loads(snapshot.forecast_json) if snapshot and snapshot.forecast_json else []
     return current, forecast
 
-def update_query_core(
+async def update_query_and_append_snapshot(
     session,
     *,
     query_id: int,
+    current: Optional["CurrentWeather"],
+    forecast: List["DailyRow"],
     input_text: Optional[str] = None,
     resolved_name: Optional[str] = None,
     lat: Optional[float] = None,
@@ -70,7 +107,8 @@ def update_query_core(
     date_range: Optional[Tuple[Optional[date], Optional[date]]] = None,
     label: Optional[str] = None,
 ) -> Optional[SearchQuery]:
-    row = session.get(SearchQuery, query_id)
+    # Row update and new snapshot in a single transaction (one commit).
+    row = await session.get(SearchQuery, query_id)
     if not row:
         return None
     if input_text is not None:
@@ -86,31 +124,19 @@ def update_query_core(
     if label is not None:
         row.label = label
     session.add(row)
-    session.commit()
-    session.refresh(row)
-    return row
-
-def append_snapshot(
-    session,
-    *,
-    query_id: int,
-    current: dict,
-    forecast: List[dict],
-) -> WeatherSnapshot:
-    snap = WeatherSnapshot(
+    session.add(WeatherSnapshot(
         query_id=query_id,
-        current_json=json.dumps(current),
-        forecast_json=json.dumps(forecast),
-    )
-    session.add(snap)
-    session.commit()
-    session.refresh(snap)
-    return snap
+        current_json=orjson.dumps(current),
+        forecast_json=orjson.dumps(forecast),
+    ))
+    await session.commit()
+    await session.refresh(row)
+    return row
 
-def delete_query_cascade(session, query_id: int) -> bool:
-    row = session.get(SearchQuery, query_id)
+async def delete_query_cascade(session, query_id: int) -> bool:
+    row = await session.get(SearchQuery, query_id)
     if not row:
         return False
-    session.delete(row)  # cascade handles snapshots
-    session.commit()
+    await session.delete(row)  # cascade handles snapshots
+    await session.commit()
     return True
\ No newline at end of file
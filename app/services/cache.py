@@ -0,0 +1,46 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+# key -> (expires_at, value), least recently used first.
+_ENTRIES: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+# key -> the upstream fetch currently running for it. Concurrent misses await
+# the same task and share its outcome (value, None or exception): "singleflight".
+_IN_FLIGHT: dict[str, asyncio.Task] = {}
+
+MAX_ENTRIES = 1024
+
+
+def _finish(key: str, ttl: float, flight: asyncio.Task):
+    if _IN_FLIGHT.get(key) is flight:
+        del _IN_FLIGHT[key]
+    if flight.cancelled() or flight.exception() is not None:
+        return
+    value = flight.result()
+    if value is None:
+        return
+    _ENTRIES[key] = (time.monotonic() + ttl, value)
+    _ENTRIES.move_to_end(key)
+    while len(_ENTRIES) > MAX_ENTRIES:
+        _ENTRIES.popitem(last=False)
+
+
+async def cached(key: str, ttl: float, coro_factory: Callable[[], Awaitable[Any]]):
+    """
+    Return the cached value for `key`, or await coro_factory() to fill it.
+    Every caller waiting on the same fetch gets its result, but None results
+    and exceptions are not stored, so the next fetch after it retries.
+    """
+    entry = _ENTRIES.get(key)
+    if entry is not None and time.monotonic() < entry[0]:
+        _ENTRIES.move_to_end(key)
+        return entry[1]
+
+    flight = _IN_FLIGHT.get(key)
+    if flight is None:
+        flight = asyncio.ensure_future(coro_factory())
+        _IN_FLIGHT[key] = flight
+        flight.add_done_callback(lambda f: _finish(key, ttl, f))
+    # shield: one caller being cancelled must not cancel the fetch for the others
+    return await asyncio.shield(flight)
@@ -1,16 +1,55 @@
 import logging
 import re
+import time
+from collections import OrderedDict
 import httpx
+import orjson
+
+from app.services.http_client import SharedClient
 
 logger = logging.getLogger(__name__)
 
+NOMINATIM_HEADERS = {"User-Agent": "markfox-weather-app/1.0 (learning project)"}
+
+# Shared client for both geocoders; opened on app startup, closed on shutdown.
+_HTTP = SharedClient(
+    http2=True,
+    timeout=8.0,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+)
+init_client = _HTTP.open
+close_client = _HTTP.aclose
+
+
+# In-process LRU of geocoding results: key -> (result, etag, expires_at).
+# City -> lat/lon is effectively immutable, so entries live for a day and are
+# then revalidated upstream with If-None-Match when an ETag was provided.
+GEO_CACHE_MAX = 4096
+GEO_CACHE_TTL = 24 * 3600
+_GEO_CACHE: "OrderedDict[str, tuple[dict, str | None, float]]" = OrderedDict()
+
+# Returned by the geocoders in place of a result when upstream answers 304.
+_NOT_MODIFIED = object()
+
+
+def _cache_put(key: str, result: dict, etag: str | None):
+    _GEO_CACHE[key] = (result, etag, time.monotonic() + GEO_CACHE_TTL)
+    _GEO_CACHE.move_to_end(key)
+    while len(_GEO_CACHE) > GEO_CACHE_MAX:
+        _GEO_CACHE.popitem(last=False)
+
+
 # Accepts "lat,lon" or "lat lon" with optional spaces
 LATLON_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*[, ]\s*(-?\d+(?:\.\d+)?)\s*$")
 
 
 def _try_parse_latlon(q: str):
     # Return dict {name, lat, lon} if q looks like coordinates.
-    m = LATLON_RE.match(q or "")
+    # Cheap pre-filter: city names never start with a sign or digit, so skip the regex.
+    s = (q or "").strip()
+    if not s or s[0] not in "+-.0123456789":
+        return None
+    m = LATLON_RE.fullmatch(s)
     if not m:
         return None
     try:
@@ -21,65 +60,67 @@ def _try_parse_latlon(q: str):
     return {"name": f"{lat:.4f},{lon:.4f}", "lat": lat, "lon": lon}
 
 
-async def _geocode_open_meteo(query: str):
-    # Primary geocoder: Open-Meteo.
+async def _geocode_open_meteo(query: str, etag: str | None = None):
+    # Primary geocoder: Open-Meteo. Returns (result, etag); result is
+    # _NOT_MODIFIED when revalidating with `etag` and upstream answers 304.
     url = "https://geocoding-api.open-meteo.com/v1/search"
     params = {"name": query, "count": 1, "language": "en", "format": "json"}
+    headers = {"If-None-Match": etag} if etag else None
     try:
-        async with httpx.AsyncClient(timeout=8.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            data = r.json()
+        client = _HTTP.get()
+        r = await client.get(url, params=params, headers=headers)
+        if r.status_code == 304:
+            return _NOT_MODIFIED, etag
+        r.raise_for_status()
+        data = orjson.loads(r.content)
     except Exception as e:
         logger.warning("Open-Meteo geocoding error: %s", e)
-        return None
+        return None, None
 
-    results = data.get("results") or []
-    if not results:
-        return None
+    top = (data.get("results") or [None])[0]
+    if top is None:
+        return None, None
 
-    top = results[0]
-    parts = [top.get("name")]
-    admin1 = top.get("admin1")
-    country = top.get("country")
-    if admin1:
-        parts.append(admin1)
-    if country:
-        parts.append(country)
+    get = top.get
+    name, admin1, country = get("name"), get("admin1"), get("country")
 
     return {
-        "name": ", ".join([p for p in parts if p]),
-        "lat": top.get("latitude"),
-        "lon": top.get("longitude"),
-        "country_code": top.get("country_code"),
+        "name": ", ".join([p for p in (name, admin1, country) if p]),
+        "lat": get("latitude"),
+        "lon": get("longitude"),
+        "country_code": get("country_code"),
         "source": "open-meteo",
-    }
+    }, r.headers.get("ETag")
 
 
-async def _geocode_nominatim(query: str):
+async def _geocode_nominatim(query: str, etag: str | None = None):
     # Fallback geocoder: Nominatim (OpenStreetMap). Requires a User-Agent.
+    # Same (result, etag) contract as _geocode_open_meteo.
     url = "https://nominatim.openstreetmap.org/search"
     params = {"q": query, "format": "jsonv2", "limit": 1}
-    headers = {"User-Agent": "markfox-weather-app/1.0 (learning project)"}
+    headers = {**NOMINATIM_HEADERS, "If-None-Match": etag} if etag else NOMINATIM_HEADERS
     try:
-        async with httpx.AsyncClient(timeout=8.0, headers=headers) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            data = r.json()
+        client = _HTTP.get()
+        r = await client.get(url, params=params, headers=headers)
+        if r.status_code == 304:
+            return _NOT_MODIFIED, etag
+        r.raise_for_status()
+        data = orjson.loads(r.content)
     except Exception as e:
         logger.warning("Nominatim geocoding error: %s", e)
-        return None
+        return None, None
 
     if not data:
-        return None
+        return None, None
 
     top = data[0]
-    display_name = top.get("display_name") or query
+    get = top.get
+    display_name, raw_lat, raw_lon = get("display_name") or query, get("lat"), get("lon")
     try:
-        lat = float(top.get("lat"))
-        lon = float(top.get("lon"))
+        lat = float(raw_lat)
+        lon = float(raw_lon)
     except (TypeError, ValueError):
-        return None
+        return None, None
 
     return {
         "name": display_name,
@@ -87,7 +128,10 @@ async def _geocode_nominatim(query: str):
         "lon": lon,
         "country_code": None,
         "source": "nominatim",
-    }
+    }, r.headers.get("ETag")
+
+
+_GEOCODERS = {"open-meteo": _geocode_open_meteo, "nominatim": _geocode_nominatim}
 
 
 async def geocode_one(query: str):
@@ -95,21 +139,36 @@ async def geocode_one(query: str):
     Resolve free-form text to a single lat/lon.
     Strategy:
       - If it's coordinates, return directly.
+      - If it's cached and fresh, return the cached result.
+      - If it's cached but stale, revalidate with the source geocoder (ETag).
       - Else try Open-Meteo, then fall back to Nominatim.
     """
     latlon = _try_parse_latlon(query)
     if latlon:
         return latlon
 
-    # Primary: Open-Meteo
-    result = await _geocode_open_meteo(query)
-    if result:
-        return result
-
-    # Fallback: Nominatim
-    result = await _geocode_nominatim(query)
-    if result:
-        return result
+    key = (query or "").strip().casefold()
+    cached = _GEO_CACHE.get(key)
+    if cached:
+        result, etag, expires_at = cached
+        if time.monotonic() < expires_at:
+            _GEO_CACHE.move_to_end(key)
+            return result
+        if etag:
+            fresh, new_etag = await _GEOCODERS[result["source"]](query, etag)
+            if fresh is _NOT_MODIFIED:
+                _cache_put(key, result, etag)
+                return result
+            if fresh:
+                _cache_put(key, fresh, new_etag)
+                return fresh
+
+    # Primary: Open-Meteo, then fallback: Nominatim
+    for geocoder in (_geocode_open_meteo, _geocode_nominatim):
+        result, etag = await geocoder(query)
+        if result:
+            _cache_put(key, result, etag)
+            return result
 
     logger.info("Geocoding failed for query=%r", query)
     return None
@@ -0,0 +1,27 @@
+from typing import Optional
+import httpx
+
+
+class SharedClient:
+    """One lazily opened httpx.AsyncClient (connection pool + HTTP/2) per upstream.
+
+    Opened on app startup, closed on shutdown; get() also opens it on first use
+    when startup hasn't run (e.g. scripts, tests).
+    """
+
+    def __init__(self, **client_kwargs):
+        self._client_kwargs = client_kwargs
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def open(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(**self._client_kwargs)
+        return self._client
+
+    def get(self) -> httpx.AsyncClient:
+        return self._client if self._client is not None else self.open()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
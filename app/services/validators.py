@@ -1,6 +1,6 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from datetime import date, datetime, timedelta
+from datetime import date, timedelta
 from typing import Optional
 
 @dataclass
@@ -9,10 +9,11 @@ class DateRange:
     end: date
 
 def _parse_iso(d: Optional[str]) -> Optional[date]:
-    if not d:
+    # Strict YYYY-MM-DD; the shape check keeps 3.11's looser ISO forms (20250101, 2025-W01-1) out.
+    if not d or len(d) != 10 or d[4] != "-" or d[7] != "-":
         return None
     try:
-        return datetime.strptime(d, "%Y-%m-%d").date()
+        return date.fromisoformat(d)
     except ValueError:
         return None
 
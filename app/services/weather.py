@@ -1,6 +1,98 @@
-from datetime import date, datetime
-from typing import Optional, List, Dict
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from itertools import islice
+from typing import Optional, List
+from urllib.parse import urlencode
 import httpx
+import orjson
+
+from app.services.cache import cached
+from app.services.http_client import SharedClient
+
+HTTP_TIMEOUT = httpx.Timeout(8.0, connect=3.0)
+# With HTTP/2, concurrent requests to a host multiplex over one connection,
+# so fewer connections are needed than under HTTP/1.1 keep-alive.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=20, keepalive_expiry=30)
+
+FORECAST_BASE_URL = "https://api.open-meteo.com"
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/era5"
+FORECAST_PATH = "/v1/forecast"
+
+_DAILY_FIELDS = "temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code"
+
+# Constant query-string tails, encoded once; only lat/lon and dates are
+# formatted per call.
+_CURRENT_QS = urlencode({
+    "current": "temperature_2m,apparent_temperature,precipitation,weather_code,wind_speed_10m",
+    "timezone": "auto",
+})
+_FORECAST_5D_QS = urlencode({"daily": _DAILY_FIELDS, "forecast_days": 5, "timezone": "auto"})
+_DAILY_QS = urlencode({"daily": _DAILY_FIELDS, "timezone": "auto"})
+
+# Days ahead of today the forecast endpoint can serve.
+FORECAST_MAX_DAYS = 16
+
+# Shared client for Open-Meteo; opened on app startup, closed on shutdown.
+# Relative paths go to the forecast host; the archive host is passed as an absolute URL.
+_HTTP = SharedClient(
+    base_url=FORECAST_BASE_URL,
+    http2=True,
+    timeout=HTTP_TIMEOUT,
+    limits=HTTP_LIMITS,
+)
+init_client = _HTTP.open
+close_client = _HTTP.aclose
+
+
+# In-process TTL caches (seconds), keyed by lat/lon rounded to ~1 km.
+# Open-Meteo updates current conditions every ~15 min and daily data hourly.
+CURRENT_TTL = 300
+FORECAST_TTL = 1800
+DAILY_RANGE_TTL = 300
+
+
+def _cell(lat: float, lon: float) -> str:
+    return f"{round(lat, 2)}:{round(lon, 2)}"
+
+
+RETRY_DELAY = 0.2  # seconds
+
+# url -> (Last-Modified, decoded body) from the last 200. Once a cached() entry
+# (TTLs above) has expired, the refetch revalidates with If-Modified-Since and a
+# 304 reuses the stored body.
+LAST_MODIFIED_MAX = 512
+_LAST_MODIFIED: "OrderedDict[str, tuple[str, dict]]" = OrderedDict()
+
+
+async def _fetch_json(url: str, retries: int = 1):
+    # GET + decode, retrying transient failures (connect/read errors, 5xx) after a short pause.
+    # Anything else (4xx, bad JSON) raises immediately.
+    client = _HTTP.get()
+    validator = _LAST_MODIFIED.get(url)
+    headers = {"If-Modified-Since": validator[0]} if validator else None
+    for attempt in range(retries + 1):
+        try:
+            r = await client.get(url, headers=headers)
+            if r.status_code == 304 and validator:
+                _LAST_MODIFIED.move_to_end(url)
+                return validator[1]
+            r.raise_for_status()
+            data = orjson.loads(r.content)
+            last_modified = r.headers.get("Last-Modified")
+            if last_modified:
+                _LAST_MODIFIED[url] = (last_modified, data)
+                _LAST_MODIFIED.move_to_end(url)
+                if len(_LAST_MODIFIED) > LAST_MODIFIED_MAX:
+                    _LAST_MODIFIED.popitem(last=False)
+            return data
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            transient = isinstance(e, httpx.TransportError) or e.response.status_code >= 500
+            if not transient or attempt == retries:
+                raise
+        await asyncio.sleep(RETRY_DELAY)
+
 
 # Minimal mapping for Open-Meteo weather codes.
 WEATHER_CODE_DESC = {
@@ -27,41 +119,56 @@ WEATHER_CODE_DESC = {
     99: "Thunderstorm w/ heavy hail",
 }
 
+# WMO codes are 0-99: a list lookup avoids hashing and per-row f-string fallbacks.
+_WEATHER_DESC_TABLE = [WEATHER_CODE_DESC.get(i, f"Code {i}") for i in range(100)]
+
+@dataclass(slots=True)
+class CurrentWeather:
+    """Current conditions from Open-Meteo; persisted and rendered as plain dicts."""
+    temperature_c: Optional[float]
+    temperature_f: Optional[float]
+    apparent_c: Optional[float]
+    apparent_f: Optional[float]
+    wind_speed: Optional[float]      # m/s
+    precipitation: Optional[float]   # mm
+    weather_code: Optional[int]
+    weather_desc: str
+
+
+@dataclass(slots=True)
+class DailyRow:
+    """One forecast/history day; persisted and rendered as plain dicts."""
+    date: str
+    tmax_c: Optional[float]
+    tmax_f: Optional[float]
+    tmin_c: Optional[float]
+    tmin_f: Optional[float]
+    precip_mm: Optional[float]
+    precip_in: Optional[float]
+    weather_code: Optional[int]
+    weather_desc: str
+
+
 def _c_to_f(c: Optional[float]) -> Optional[float]:
     if c is None:
         return None
     return c * 9 / 5 + 32
 
-def _mm_to_in(mm: Optional[float]) -> Optional[float]:
-    if mm is None:
-        return None
-    return mm / 25.4
-
 
 async def get_current_weather(lat: float, lon: float):
+    # Cached per ~1 km cell; concurrent misses share one upstream request.
+    return await cached(f"c:{_cell(lat, lon)}", CURRENT_TTL, lambda: _fetch_current_weather(lat, lon))
+
+
+async def _fetch_current_weather(lat: float, lon: float):
     """
     Fetch current weather from Open-Meteo.
-    Returns dict or None:
-    {
-      temperature_c, temperature_f,
-      apparent_c, apparent_f,
-      wind_speed, precipitation,
-      weather_code, weather_desc
-    }
+    Returns CurrentWeather or None.
     """
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "current": "temperature_2m,apparent_temperature,precipitation,weather_code,wind_speed_10m",
-        "timezone": "auto",
-    }
+    url = f"{FORECAST_PATH}?latitude={lat}&longitude={lon}&{_CURRENT_QS}"
 
     try:
-        async with httpx.AsyncClient(timeout=8.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            data = r.json()
+        data = await _fetch_json(url)
     except Exception:
         return None
 
@@ -72,168 +179,124 @@ async def get_current_weather(lat: float, lon: float):
     temp_c = cur.get("temperature_2m")
     feels_c = cur.get("apparent_temperature")
 
-    return {
-        "temperature_c": temp_c,
-        "temperature_f": _c_to_f(temp_c),
-        "apparent_c": feels_c,
-        "apparent_f": _c_to_f(feels_c),
-        "wind_speed": cur.get("wind_speed_10m"),   # m/s
-        "precipitation": cur.get("precipitation"), # mm
-        "weather_code": code,
-        "weather_desc": desc,
-    }
+    return CurrentWeather(
+        temperature_c=temp_c,
+        temperature_f=_c_to_f(temp_c),
+        apparent_c=feels_c,
+        apparent_f=_c_to_f(feels_c),
+        wind_speed=cur.get("wind_speed_10m"),
+        precipitation=cur.get("precipitation"),
+        weather_code=code,
+        weather_desc=desc,
+    )
+
 
+async def get_forecast_5d(lat: float, lon: float) -> Optional[List[DailyRow]]:
+    # Cached per ~1 km cell; concurrent misses share one upstream request.
+    return await cached(f"f:{_cell(lat, lon)}", FORECAST_TTL, lambda: _fetch_forecast_5d(lat, lon))
 
-async def get_forecast_5d(lat: float, lon: float) -> Optional[List[Dict]]:
+
+async def _fetch_forecast_5d(lat: float, lon: float) -> Optional[List[DailyRow]]:
     """
     Fetch a 5-day daily forecast from Open-Meteo.
-    Returns a list of dicts (len up to 5), or None:
+    Returns a list of DailyRow (len up to 5), or None:
     [
-      {
-        "date": "2025-09-30",
-        "tmax_c": 23.1, "tmax_f": 73.6,
-        "tmin_c": 12.4, "tmin_f": 54.3,
-        "precip_mm": 3.2, "precip_in": 0.13,
-        "weather_code": 63,
-        "weather_desc": "Moderate rain",
-      },
+      DailyRow(
+        date="2025-09-30",
+        tmax_c=23.1, tmax_f=73.6,
+        tmin_c=12.4, tmin_f=54.3,
+        precip_mm=3.2, precip_in=0.13,
+        weather_code=63,
+        weather_desc="Moderate rain",
+      ),
       ...
     ]
     """
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code",
-        "forecast_days": 5,          # ask for exactly 5
-        "timezone": "auto",
-    }
+    url = f"{FORECAST_PATH}?latitude={lat}&longitude={lon}&{_FORECAST_5D_QS}"  # exactly 5 days
 
     try:
-        async with httpx.AsyncClient(timeout=8.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            data = r.json()
+        data = await _fetch_json(url)
     except Exception:
         return None
 
-    daily = data.get("daily") or {}
+    return _rows_from_daily(data.get("daily") or {}, limit=5)
+
+
+def _rows_from_daily(daily: dict, limit: Optional[int] = None) -> List[DailyRow]:
+    # Build per-day rows from Open-Meteo's column-major "daily" block.
+    # Unit conversions run once per column, before the rows are assembled.
     times = daily.get("time") or []
     tmax = daily.get("temperature_2m_max") or []
     tmin = daily.get("temperature_2m_min") or []
     precip = daily.get("precipitation_sum") or []
     codes = daily.get("weather_code") or []
 
-    out: List[Dict] = []
-    for i in range(min(5, len(times))):
-        code = codes[i] if i < len(codes) else None
-        desc = WEATHER_CODE_DESC.get(code, f"Code {code}") if code is not None else "—"
-
-        tmax_c = tmax[i] if i < len(tmax) else None
-        tmin_c = tmin[i] if i < len(tmin) else None
-        prec_mm = precip[i] if i < len(precip) else None
-
-        out.append({
-            "date": times[i],
-            "tmax_c": tmax_c,
-            "tmax_f": _c_to_f(tmax_c),
-            "tmin_c": tmin_c,
-            "tmin_f": _c_to_f(tmin_c),
-            "precip_mm": prec_mm,
-            "precip_in": _mm_to_in(prec_mm),
-            "weather_code": code,
-            "weather_desc": desc,
-        })
+    tmax_f = [_c_to_f(c) for c in tmax]
+    tmin_f = [_c_to_f(c) for c in tmin]
+    precip_in = [None if mm is None else mm / 25.4 for mm in precip]
+
+    # Open-Meteo returns equal-length columns; zip stops at the shortest.
+    rows = zip(times, tmax, tmax_f, tmin, tmin_f, precip, precip_in, codes)
+    if limit is not None:
+        rows = islice(rows, limit)
 
+    out: List[DailyRow] = []
+    for day, tx_c, tx_f, tn_c, tn_f, pr_mm, pr_in, code in rows:
+        desc = "—" if code is None else _WEATHER_DESC_TABLE[code] if 0 <= code < 100 else f"Code {code}"
+        out.append(DailyRow(day, tx_c, tx_f, tn_c, tn_f, pr_mm, pr_in, code, desc))
     return out
 
-async def _daily_rows_from_open_meteo(url: str, params: dict) -> Optional[List[Dict]]:
-    import httpx
+
+def _daily_url(base: str, lat: float, lon: float, start: str, end: str) -> str:
+    # URL for a daily [start, end] request; dates are ISO strings.
+    return f"{base}?latitude={lat}&longitude={lon}&start_date={start}&end_date={end}&{_DAILY_QS}"
+
+
+async def _daily_rows_from_open_meteo(url: str) -> Optional[List[DailyRow]]:
     try:
-        async with httpx.AsyncClient(timeout=8.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            data = r.json()
+        data = await _fetch_json(url)
     except Exception:
         return None
 
-    daily = data.get("daily") or {}
-    times = daily.get("time") or []
-    tmax = daily.get("temperature_2m_max") or []
-    tmin = daily.get("temperature_2m_min") or []
-    precip = daily.get("precipitation_sum") or []
-    codes = daily.get("weather_code") or []
+    return _rows_from_daily(data.get("daily") or {})
 
-    out: List[Dict] = []
-    n = len(times)
-    for i in range(n):
-        code = codes[i] if i < len(codes) else None
-        desc = WEATHER_CODE_DESC.get(code, f"Code {code}") if code is not None else "—"
-        tmax_c = tmax[i] if i < len(tmax) else None
-        tmin_c = tmin[i] if i < len(tmin) else None
-        prec_mm = precip[i] if i < len(precip) else None
-        out.append({
-            "date": times[i],
-            "tmax_c": tmax_c, "tmax_f": _c_to_f(tmax_c),
-            "tmin_c": tmin_c, "tmin_f": _c_to_f(tmin_c),
-            "precip_mm": prec_mm, "precip_in": _mm_to_in(prec_mm),
-            "weather_code": code, "weather_desc": desc,
-        })
-    return out
+async def get_daily_range(lat: float, lon: float, start: date, end: date) -> Optional[List[DailyRow]]:
+    # Cached per ~1 km cell and date range; concurrent misses share one upstream request.
+    return await cached(f"d:{_cell(lat, lon)}:{start}:{end}", DAILY_RANGE_TTL, lambda: _fetch_daily_range(lat, lon, start, end))
 
-async def get_daily_range(lat: float, lon: float, start: date, end: date) -> Optional[List[Dict]]:
+
+async def _fetch_daily_range(lat: float, lon: float, start: date, end: date) -> Optional[List[DailyRow]]:
     # Return daily rows for [start, end] inclusive, merging archive + forecast if needed.
     today = date.today()
+    start_s, end_s = start.isoformat(), end.isoformat()
 
     # Entirely past >> archive
     if end < today:
-        return await _daily_rows_from_open_meteo(
-            "https://archive-api.open-meteo.com/v1/era5",
-            {
-                "latitude": lat, "longitude": lon,
-                "start_date": start.isoformat(),
-                "end_date": end.isoformat(),
-                "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code",
-                "timezone": "auto",
-            },
-        )
-
-    # Entirely future >> forecast (Open-Meteo can go up to ~16 days ahead)
-    if start > today:
-        return await _daily_rows_from_open_meteo(
-            "https://api.open-meteo.com/v1/forecast",
-            {
-                "latitude": lat, "longitude": lon,
-                "start_date": start.isoformat(),
-                "end_date": end.isoformat(),
-                "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code",
-                "timezone": "auto",
-            },
-        )
-
-    # Crossing today >> split into [start, today] archive and [today, end] forecast; merge
-    past = await _daily_rows_from_open_meteo(
-        "https://archive-api.open-meteo.com/v1/era5",
-        {
-            "latitude": lat, "longitude": lon,
-            "start_date": start.isoformat(),
-            "end_date": today.isoformat(),
-            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code",
-            "timezone": "auto",
-        },
-    )
+        return await _daily_rows_from_open_meteo(_daily_url(ARCHIVE_URL, lat, lon, start_s, end_s))
+
+    # Entirely future, or crossing today with an end within ~16 days >> one forecast
+    # call. The forecast endpoint also serves up to 92 past days, which always
+    # covers the start of a crossing range under the 31-day cap in validate_date_range.
+    if start > today or (end - today).days + 1 <= FORECAST_MAX_DAYS:
+        return await _daily_rows_from_open_meteo(_daily_url(FORECAST_PATH, lat, lon, start_s, end_s))
 
-    future = await _daily_rows_from_open_meteo(
-        "https://api.open-meteo.com/v1/forecast",
-        {
-            "latitude": lat, "longitude": lon,
-            "start_date": today.isoformat(),
-            "end_date": end.isoformat(),
-            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,weather_code",
-            "timezone": "auto",
-        },
+    # Crossing today, longer span >> split into [start, today] archive and
+    # [today, end] forecast, fetched concurrently; merge
+    today_s = today.isoformat()
+    past, future = await asyncio.gather(
+        _daily_rows_from_open_meteo(_daily_url(ARCHIVE_URL, lat, lon, start_s, today_s)),
+        _daily_rows_from_open_meteo(_daily_url(FORECAST_PATH, lat, lon, today_s, end_s)),
+        return_exceptions=True,
     )
+    if isinstance(past, Exception):
+        past = None
+    if isinstance(future, Exception):
+        future = None
 
     if past is None and future is None:
         return None
+    # Both halves include today; keep the forecast's row (the archive lags by days,
+    # so its row for today is usually empty)
+    if past and future and past[-1].date == future[0].date:
+        past = past[:-1]
     return (past or []) + (future or [])
\ No newline at end of file
@@ -37,9 +37,18 @@
     });
   }
 
+  // POST /search renders the result directly; swap the address bar to the
+  // bookmarkable /result?id=… so a refresh is a GET, not a form resubmit.
+  function initCanonicalUrl(elementId) {
+    const el = document.getElementById(elementId);
+    if (!el || !el.dataset.canonicalUrl || !window.history.replaceState) return;
+    window.history.replaceState(null, '', el.dataset.canonicalUrl);
+  }
+
   // Initialize on both pages if present
   document.addEventListener('DOMContentLoaded', function () {
     initUseMyLocation('use-loc-btn', 'use-loc-msg');       // index.html
     initUseMyLocation('use-loc-btn-result', 'use-loc-msg-result'); // result.html (optional)
+    initCanonicalUrl('result-links');                      // result.html
   });
 }());